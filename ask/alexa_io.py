@@ -1,4 +1,5 @@
 import os
+import copy
 from collections import OrderedDict, defaultdict
 import json
 import pkgutil
@@ -90,6 +91,7 @@ class ResponseBuilder(object):
         card_obj = JSON card object to substitute the 'card' field in the raw_response
         """
         response = dict(self.base_response)
+        response['response'] = dict(self.base_response['response'])
         if message:
             response['response'] = self.create_speech(message, is_ssml)
         response['response']['shouldEndSession'] = end_session
@@ -129,6 +131,28 @@ class ResponseBuilder(object):
         return card
 
 
+class BeforeHook(object):
+    ''' Middleware running func(request) before the handler, a returned
+    response short-circuits the handler '''
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, request, call_next):
+        response = self.func(request)
+        return call_next(request) if response is None else response
+
+
+class AfterHook(object):
+    ''' Middleware running func(request, response) -> response after the
+    handler. The hook gets a deep copy, so it may edit the response freely
+    without touching prebuilt or cached responses. '''
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, request, call_next):
+        return self.func(request, copy.deepcopy(call_next(request)))
+
+
 class VoiceHandler(ResponseBuilder):
     """    Decorator to store function metadata
     Functions that are annotated with this label are
@@ -137,6 +161,7 @@ class VoiceHandler(ResponseBuilder):
     def __init__(self):
         self._handlers = { "IntentRequest" : {} }
         self._default = '_default_'
+        self._middleware = defaultdict(list) # None holds the global middleware
 
         
     def default_handler(self):
@@ -144,6 +169,7 @@ class VoiceHandler(ResponseBuilder):
 
         def _handler(func):
             self._handlers[self._default] = func
+            return func
 
         return _handler
 
@@ -153,6 +179,7 @@ class VoiceHandler(ResponseBuilder):
 
         def _handler(func):
             self._handlers['IntentRequest'][intent] = func
+            return func
 
         return _handler
 
@@ -162,12 +189,91 @@ class VoiceHandler(ResponseBuilder):
 
         def _handler(func):
             self._handlers[request_type] = func
+            return func
+
+        return _handler
+
+
+    def use(self, middleware, intent=None):
+        '''
+        Register an around middleware: middleware(request, call_next) -> response
+        It is applied to every request, or only to the given intent / request type.
+        Global middleware wraps per intent middleware, in registration order.
+        Responses may be shared (prebuilt or cached), return a modified copy
+        instead of editing them in place.
+        '''
+        self._middleware[intent].append(middleware)
+        return middleware
+
+
+    def middleware(self, intent=None):
+        ''' Decorator to register an around middleware '''
+
+        def _handler(func):
+            return self.use(func, intent)
+
+        return _handler
+
+
+    def before(self, intent=None):
+        ''' Decorator to register a hook run before the handler.
+        A hook returning a response short-circuits the handler. '''
+
+        def _handler(func):
+            self.use(BeforeHook(func), intent)
+            return func
 
         return _handler
 
 
+    def after(self, intent=None):
+        ''' Decorator to register a hook run after the handler,
+        func(request, response) -> response '''
+
+        def _handler(func):
+            self.use(AfterHook(func), intent)
+            return func
+
+        return _handler
+
+
+    def middleware_chain(self, request):
+        ''' Middleware registered for this request, outermost first '''
+        key = request.intent_name() if request.is_intent() else request.request_type()
+        return self._middleware[None] + self._middleware.get(key, [])
+
+
+    def wrap_handler(self, request, handler_fn):
+        ''' Chain the middleware registered for this request around handler_fn '''
+        for middleware in reversed(self.middleware_chain(request)):
+            handler_fn = self._bind(middleware, handler_fn)
+        return handler_fn
+
+
+    @staticmethod
+    def _bind(middleware, call_next):
+        return lambda request: middleware(request, call_next)
+
+
     def route_request(self, request_json, metadata=None):
         ''' Route the request object to the right handler function '''
+        request, handler_fn = self.resolve_handler(request_json, metadata)
+        handler_fn = self.wrap_handler(request, handler_fn)
+        # shallow copy so prebuilt (shared) responses are never mutated
+        response = dict(handler_fn(request))
+        response['sessionAttributes'] = request.session
+        return response
+
+
+    def route_request_async(self, request_json, metadata=None):
+        ''' Coroutine variant of route_request which awaits coroutine handlers
+        and still calls plain (sync) handlers. Requires Python 3.7+ '''
+        from .alexa_io_async import route_request_async
+        return route_request_async(self, request_json, metadata)
+
+
+    def resolve_handler(self, request_json, metadata=None):
+        ''' Build the Request object and pick the handler function for it '''
         request = Request(request_json)
         request.metadata = metadata        
         handler_fn = self._handlers[self._default] # Set default handling for noisy requests
@@ -184,6 +290,4 @@ class VoiceHandler(ResponseBuilder):
             ''' Route to right intent handler '''
             handler_fn = self._handlers['IntentRequest'][request.intent_name()]
 
-        response = handler_fn(request)
-        response['sessionAttributes'] = request.session
-        return response
+        return request, handler_fn
@@ -0,0 +1,129 @@
+'''
+asyncio flavoured request routing. Kept in its own module so that
+alexa_io stays importable on Python 2.7 (Lambda) while host mode on
+Python 3 can serve many concurrent requests from a single event loop.
+
+Middleware is synchronous by default. Around coroutine handlers each one
+is replaced by its coroutine counterpart: middleware that is itself a
+coroutine function is used as is, the built-ins are registered below with
+async_middleware, and other middleware raises TypeError.
+'''
+import asyncio
+import copy
+import cProfile
+import inspect
+import time
+from .alexa_io import BeforeHook, AfterHook
+from .middleware import timing, log_timing, ResponseCache, ErrorSpeech, SamplingProfiler
+
+_async_middleware = {}
+
+
+def async_middleware(sync_middleware):
+    '''
+    Decorator registering the coroutine counterpart of a middleware
+    function, or of every instance of a middleware class. Counterparts of
+    classes get the instance as first argument.
+    '''
+    def _handler(func):
+        _async_middleware[sync_middleware] = func
+        return func
+
+    return _handler
+
+
+def as_async(middleware):
+    ''' Coroutine counterpart of a middleware, (request, call_next) -> response '''
+    if inspect.iscoroutinefunction(middleware):
+        return middleware
+    if middleware in _async_middleware:
+        return _async_middleware[middleware]
+    for cls in type(middleware).__mro__:
+        if cls in _async_middleware:
+            func = _async_middleware[cls]
+            return lambda request, call_next: func(middleware, request, call_next)
+    raise TypeError("Middleware {!r} cannot wrap a coroutine handler".format(middleware))
+
+
+def wrap_handler_async(voice_handler, request, handler_fn):
+    ''' Chain the coroutine counterparts of the middleware around handler_fn '''
+    for middleware in reversed(voice_handler.middleware_chain(request)):
+        handler_fn = _bind(as_async(middleware), handler_fn)
+    return handler_fn
+
+
+def _bind(middleware, call_next):
+    return lambda request: middleware(request, call_next)
+
+
+async def route_request_async(voice_handler, request_json, metadata=None):
+    ''' Route the request object to the right handler function and await it
+    if it is a coroutine function. Sync handlers, which may block, run with
+    their (sync) middleware in the loop's default executor. '''
+    request, handler_fn = voice_handler.resolve_handler(request_json, metadata)
+    if inspect.iscoroutinefunction(handler_fn):
+        response = await wrap_handler_async(voice_handler, request, handler_fn)(request)
+    else:
+        handler_fn = voice_handler.wrap_handler(request, handler_fn)
+        response = await asyncio.get_running_loop().run_in_executor(None, handler_fn, request)
+    response = dict(response)
+    response['sessionAttributes'] = request.session
+    return response
+
+
+# --------------- Coroutine counterparts of the built-in middleware ----------------------
+
+
+@async_middleware(timing)
+async def _timing(request, call_next):
+    start = time.time()
+    try:
+        return await call_next(request)
+    finally:
+        log_timing(request, start)
+
+
+@async_middleware(ResponseCache)
+async def _response_cache(cache, request, call_next):
+    key = cache.key(request)
+    response = cache.get(key)
+    if response is None:
+        response = await call_next(request)
+        cache.put(key, response)
+    return response
+
+
+@async_middleware(ErrorSpeech)
+async def _error_speech(error_speech, request, call_next):
+    try:
+        return await call_next(request)
+    except Exception as e:
+        return error_speech.speak(request, e)
+
+
+@async_middleware(SamplingProfiler)
+async def _sampling_profiler(profiler, request, call_next):
+    ''' Note the profile also covers whatever else the event loop runs
+    while the handler awaits '''
+    if not profiler.sampled():
+        return await call_next(request)
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return await call_next(request)
+    finally:
+        profile.disable()
+        profiler.release()
+        profiler.report(request, profile)
+
+
+@async_middleware(BeforeHook)
+async def _before_hook(hook, request, call_next):
+    response = hook.func(request)
+    return await call_next(request) if response is None else response
+
+
+@async_middleware(AfterHook)
+async def _after_hook(hook, request, call_next):
+    return hook.func(request, copy.deepcopy(await call_next(request)))
@@ -0,0 +1,149 @@
+'''
+Built-in middleware for VoiceHandler.use(). Each one is a callable
+middleware(request, call_next) -> response, e.g.
+
+    alexa.use(timing)
+    alexa.use(ResponseCache(ttl=300), intent='TotalMonSpend')
+
+Their coroutine counterparts, used around async handlers, are registered
+in alexa_io_async.
+'''
+import cProfile
+import logging
+import pstats
+import random
+import threading
+import time
+from .alexa_io import ResponseBuilder
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+def _handler_name(request):
+    return request.intent_name() or request.request_type()
+
+
+def timing(request, call_next):
+    ''' Log how long the handler took '''
+    start = time.time()
+    try:
+        return call_next(request)
+    finally:
+        log_timing(request, start)
+
+
+def log_timing(request, start):
+    logging.info("%s handled in %.1f ms", _handler_name(request),
+                 (time.time() - start) * 1000)
+
+
+class ResponseCache(object):
+    '''
+    Cache responses by (intent, slots, tenant) for ttl seconds. The tenant
+    is read from request.metadata[tenant_key]. Only returned responses are
+    cached: handlers must raise (e.g. for ErrorSpeech to answer) rather than
+    return a response describing a failure.
+    '''
+    def __init__(self, ttl=60, tenant_key='api_base', max_entries=1024):
+        self.ttl = ttl
+        self.tenant_key = tenant_key
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def key(self, request):
+        slots = getattr(request, 'slots', None) or {}
+        return (_handler_name(request), tuple(sorted(slots.items())),
+                (request.metadata or {}).get(self.tenant_key))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        return None
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = dict((k, v) for k, v in self._entries.items() if v[0] > now)
+            if len(self._entries) < self.max_entries:
+                self._entries[key] = (now + self.ttl, response)
+
+    def __call__(self, request, call_next):
+        key = self.key(request)
+        response = self.get(key)
+        if response is None:
+            response = call_next(request)
+            self.put(key, response)
+        return response
+
+
+class ErrorSpeech(object):
+    '''
+    Turn exceptions raised by the handler into a spoken response instead
+    of a failed skill invocation. `messages` maps exception types to speech,
+    checked in order; anything else gets the default message.
+    '''
+    def __init__(self, message="Sorry, something went wrong. Please try again later.",
+                 messages=None, end_session=False):
+        self.message = message
+        self.messages = messages or []
+        self.end_session = end_session
+
+    def __call__(self, request, call_next):
+        try:
+            return call_next(request)
+        except Exception as e:
+            return self.speak(request, e)
+
+    def speak(self, request, error):
+        logging.exception("Error in %s handler", _handler_name(request))
+        message = next((msg for exc_type, msg in self.messages
+                        if isinstance(error, exc_type)), self.message)
+        return ResponseBuilder.create_response(message, end_session=self.end_session)
+
+
+# Only one cProfile profile can be active per process (Python 3.12+ raises
+# ValueError for a second one), so concurrent samples are skipped
+_profiling = threading.Lock()
+
+
+class SamplingProfiler(object):
+    '''
+    Run a fraction (`rate`) of the requests under cProfile and log the
+    top `limit` entries of the stats sorted by `sort_by`. A request is not
+    profiled while another one is.
+    '''
+    def __init__(self, rate=0.01, sort_by='cumulative', limit=20):
+        self.rate = rate
+        self.sort_by = sort_by
+        self.limit = limit
+
+    def sampled(self):
+        ''' True when this request is to be profiled, in which case the
+        caller holds the profiling lock until release() '''
+        return random.random() < self.rate and _profiling.acquire(False)
+
+    def release(self):
+        _profiling.release()
+
+    def __call__(self, request, call_next):
+        if not self.sampled():
+            return call_next(request)
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(call_next, request)
+        finally:
+            self.release()
+            self.report(request, profiler)
+
+    def report(self, request, profiler):
+        out = StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats(self.sort_by).print_stats(self.limit)
+        logging.info("Profile of %s handler:\n%s", _handler_name(request), out.getvalue())
@@ -0,0 +1,41 @@
+'''
+Helpers to render speech as SSML. Numbers and currency amounts are wrapped
+in say-as markup so the Echo reads "$1,234,567.89" as an amount rather than
+symbol by symbol. Templates are plain format strings bound once at import
+time by the caller, e.g.
+
+    SPEND = ssml_template("The spend for this month is {amount}")
+    message = SPEND(amount=currency(1234.5))
+'''
+from xml.sax.saxutils import escape
+
+
+def say_as(value, interpret_as="cardinal"):
+    return '<say-as interpret-as="{}">{}</say-as>'.format(interpret_as, value)
+
+
+def currency(amount, unit="dollar", subunit="cent"):
+    ''' Render an amount as "<n> dollars and <m> cents" '''
+    cents_total = int(round(abs(amount) * 100))
+    whole, cents = divmod(cents_total, 100)
+    sign = "minus " if amount < 0 and cents_total else ""
+    speech = "{}{} {}{}".format(sign, say_as(whole), unit, "" if whole == 1 else "s")
+    if cents:
+        speech += " and {} {}{}".format(say_as(cents), subunit, "" if cents == 1 else "s")
+    return speech
+
+
+def text(value):
+    ''' Escape free text (e.g. values returned by an API) for use in SSML '''
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return escape(u"{}".format(value))
+
+
+def ssml_template(template):
+    '''
+    Compile a template once: returns a callable rendering the template
+    into a <speak> document. Substituted values must already be SSML safe
+    (use say_as/currency/text).
+    '''
+    return (u"<speak>" + template + u"</speak>").format
@@ -10,10 +10,30 @@ import os
 import urllib
 import requests
 from ask import alexa
+from ask.speech import ssml_template, currency, text
+from ask.middleware import timing, ErrorSpeech, ResponseCache, SamplingProfiler
 from ncs.osph_metric_io import MetricData
+from ncs.osph_rate_limit import RateLimiter, FileLockBackend, AnswerCache
+from ncs.osph_errors import OneSphereError, RateLimited
+from ncs.osph_metadata_index import MetadataIndex
 
 __version__ = "1.0"
 
+# Outbound budget per tenant (api_base) and endpoint. Set rate_limit_dir to
+# share the budget between worker processes on the same host.
+RATE_LIMITER = RateLimiter(
+    default=(float(os.environ.get('rate_limit', 5)), float(os.environ.get('rate_burst', 10))),
+    limits={'/session': (1, 5)},
+    backend=FileLockBackend(os.environ['rate_limit_dir']) if 'rate_limit_dir' in os.environ else None)
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('rate_limit_max_wait', 1.0))
+
+# Last good answer per call, served when the budget is exhausted. Session
+# tokens are only reused for a short while so expired ones are not handed out.
+ANSWER_CACHE = AnswerCache(default_ttl=3600, ttls={'/session': 600})
+
+# Provider / project / zone name -> URI index, one per tenant (api_base)
+_metadata_indexes = {}
+
 
 def lambda_handler(request_obj, context=None):
     '''
@@ -30,8 +50,11 @@ def lambda_handler(request_obj, context=None):
     skill_id = os.environ['skill_id']
     event_session = None   # event['session']
 
-    # Get session ID
-    session_token = create_ns_session(api_base, user_name, password, event_session)
+    # Get session ID (None when shed, handlers needing it report the service as busy)
+    try:
+        session_token = create_ns_session(api_base, user_name, password, event_session)
+    except RateLimited:
+        session_token = None
     logging.debug("create_ns_session: token = %s", session_token)
     logging.debug("create_ns_session: api_base = %s", api_base)
 
@@ -57,19 +80,64 @@ def lambda_handler(request_obj, context=None):
 def safe_requests(f, *args, **kwargs):
     """ A helper function to wrap requests calls with try/except block
     """
+    status, body, headers = safe_response(f, *args, **kwargs)
+    if status is not None and status != 200:
+        logging.error("Error: Unexpected response {}".format(status))
+    return body
+
+
+def safe_response(f, *args, **kwargs):
+    """ Like safe_requests but returns (status, json body, headers) so callers
+    can tell e.g. 304 Not Modified apart from failures. status is None when
+    the request failed before any response, body is {} unless status is 200.
+    """
     try:
 
         r = f(*args, **kwargs)
 
         if r.status_code != 200:
-            logging.error("Error: Unexpected response {}".format(r))
-            return {}
+            return r.status_code, {}, r.headers
         else:
-            return r.json()
+            return r.status_code, r.json(), r.headers
 
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         logging.error("Error: {}".format(e))
-        return {}
+        return None, {}, {}
+
+
+def budgeted_requests(f, api_base, endpoint, **kwargs):
+    """ safe_requests within the per tenant/endpoint rate limit. When over
+    budget the last good answer for the same call is preferred, otherwise
+    the call is queued for up to RATE_LIMIT_MAX_WAIT seconds and then shed
+    by raising RateLimited.
+    """
+    key = (api_base, repr(kwargs.get('params')), repr(kwargs.get('data')))
+    cached = ANSWER_CACHE.get(endpoint, key)
+    max_wait = 0.0 if cached is not None else RATE_LIMIT_MAX_WAIT
+
+    if not RATE_LIMITER.acquire(api_base, endpoint, max_wait=max_wait):
+        # A concurrent call may have stored an answer while this one queued
+        cached = cached if cached is not None else ANSWER_CACHE.get(endpoint, key)
+        if cached is not None:
+            logging.info("Rate limit: served cached answer for %s%s", api_base, endpoint)
+            return cached
+        logging.warning("Rate limit: shedding call to %s%s", api_base, endpoint)
+        raise RateLimited(api_base + endpoint)
+
+    r = safe_requests(f, api_base + endpoint, **kwargs)
+    if r:
+        ANSWER_CACHE.put(endpoint, key, r)
+    return r
+
+
+def session_token(request):
+    """ The OneSphere session token of the request, RateLimited if the
+    session call was shed
+    """
+    token = request.metadata.get('token', None)
+    if token is None:
+        raise RateLimited("/session")
+    return token
 
 
 def create_ns_session(api_base, user_name, password, session_id):
@@ -80,16 +148,175 @@ def create_ns_session(api_base, user_name, password, session_id):
     # Get session key
     payload = {'userName': user_name, 'password': password}
 
-    r = safe_requests(requests.post, api_base + "/session",
-                      data=json.dumps(payload),
-                      headers={'accept': 'application/json', 'Content-Type': 'application/json'}
-                      )
+    r = budgeted_requests(requests.post, api_base, "/session",
+                          data=json.dumps(payload),
+                          headers={'accept': 'application/json', 'Content-Type': 'application/json'}
+                          )
 
     if 'token' in r:
         return r['token']
     else:
         return ""
 
+
+def resolve_uri(request, collection, spoken_name):
+    """ Resolve a spoken provider, provider type, project or zone name (e.g. a
+    slot value) to its URI using the cached metadata index of the tenant.
+    The collection is only listed again once its index entry is stale.
+    """
+    api_base = request.metadata.get('api_base', None)
+    token = session_token(request)
+    index = _metadata_indexes.setdefault(api_base, MetadataIndex())
+
+    def fetch(endpoint, params, headers):
+        if not RATE_LIMITER.acquire(api_base, endpoint, max_wait=RATE_LIMIT_MAX_WAIT):
+            logging.warning("Rate limit: shedding call to %s%s", api_base, endpoint)
+            raise RateLimited(api_base + endpoint)
+        return safe_response(requests.get, api_base + endpoint, params=params, headers=headers)
+
+    return index.lookup(collection, spoken_name, fetch=fetch,
+                        headers={'accept': 'application/json', 'Authorization': token})
+
+
+def provider_type_uri(request):
+    """ URI of the provider type named by the optional ProviderType slot.
+    Falls back to the private cloud provider type when the slot is empty or
+    its value cannot be resolved.
+    """
+    spoken_name = request.get_slot_value('ProviderType')
+    if spoken_name:
+        try:
+            uri = resolve_uri(request, 'provider-types', spoken_name)
+            if uri is not None:
+                return uri
+        except OneSphereError as e:
+            logging.warning("Could not resolve provider type %s: %s", spoken_name, e)
+    return NCS_PROVIDER_TYPE_URI
+
+# --------------- Speech templates, metrics queries and responses ----------------------
+# (shared with lambda_function_async.py)
+
+SERVICE_STATUS_SPEECH = ssml_template("The OneSphere service is currently {status}")
+TOTAL_SPEND_SPEECH = ssml_template("The OneSphere service spend for this month is {amount}")
+ONPREM_SPEND_SPEECH = ssml_template("The OneSphere service private cloud spend for this month is {amount}")
+ONPREM_EFFICIENCY_SPEECH = ssml_template(
+    "The OneSphere service private cloud efficiency for this month is {amount}")
+
+# periodStart should default to the current month
+# 'periodStart': '2018-01-01T00:00:00Z',
+TOTAL_SPEND_QUERY = {'category': 'providers', 'name': 'cost.total',
+                     'period': 'month', 'periodCount': '-1', 'view': 'full'}
+ONPREM_EFFICIENCY_QUERY = {'category': 'providers', 'groupBy': 'providerTypeUri',
+                           'name': 'cost.efficiency', 'period': 'month', 'periodCount': '-1', 'view': 'full'
+                           }
+
+
+# Provider type of the private cloud, used unless the request names another one
+NCS_PROVIDER_TYPE_URI = '/rest/provider-types/ncs'
+
+
+def onprem_spend_query(provider_type_uri):
+    return {'category': 'providers', 'query': 'providerTypeUri EQ ' + provider_type_uri,
+            'name': 'cost.usage', 'period': 'month', 'periodCount': '-1', 'view': 'full'
+            }
+
+
+def status_response(r):
+    """ Response for a /status answer. Raises rather than answer so the
+    failure is never cached.
+    """
+    if 'service' not in r:
+        raise OneSphereError("no service status returned")
+    speech_output = SERVICE_STATUS_SPEECH(status=text(r["service"]))
+
+    card = alexa.create_card(title="GetServiceStatusIntent activated", subtitle=None,
+                             content="asked alexa to query the OneSphere service status REST API")
+
+    return alexa.create_response(speech_output,end_session=False, card_obj=card, is_ssml=True)
+
+
+def metrics_response(r, speech, card_title, card_content):
+    """ Response speaking the total of a /metrics answer. A failed call
+    must not be read as zero spend, so it raises instead.
+    """
+    if not r:
+        raise OneSphereError("no metrics returned")
+    metric_data = MetricData(r)
+    total_spend = metric_data.get_cost()
+    speech_output = speech(amount=currency(total_spend))
+
+    card = alexa.create_card(title=card_title, subtitle=None, content=card_content)
+
+    return alexa.create_response(speech_output,end_session=False, card_obj=card, is_ssml=True)
+
+
+def total_spend_response(r):
+    return metrics_response(r, TOTAL_SPEND_SPEECH, "GetTotMonSpendIntent activated",
+                            "asked alexa to query the OneSphere metrics REST API and calculate"\
+                            " the total monthly spend")
+
+
+def onprem_spend_response(r):
+    return metrics_response(r, ONPREM_SPEND_SPEECH, "GetOnpremSpendIntent activated",
+                            "asked alexa to query the OneSphere metrics REST API and calculate" \
+                            " the total private cloud monthly spend")
+
+
+def onprem_efficiency_response(r):
+    return metrics_response(r, ONPREM_EFFICIENCY_SPEECH, "GetOnpremCostEfficiencyIntent activated",
+                            "asked alexa to query the OneSphere metrics REST API and calculate" \
+                            " the total private cloud monthly cost efficiency")
+
+
+# Responses without any per-request content are built once at import time
+DEFAULT_RESPONSE = alexa.create_response(message="Just ask")
+
+LAUNCH_RESPONSE = alexa.create_response(
+    message="Welcome to the OneSphere voice activated cloud management console. " +
+            "Please ask me something about your OneSphere service")
+
+SESSION_ENDED_RESPONSE = alexa.create_response(
+    message="Thank you for trying the OneSphere voice activated cloud management console. " +
+            "Have a nice day! ")
+
+BROHUG_RESPONSE = alexa.create_response(
+    message="You must remember to maintain a safe groin distance of 1 foot " +
+            "when executing a proper bro hug.",
+    end_session=False,
+    card_obj=alexa.create_card(title="GetBroHugIntent activated", subtitle=None,
+                               content="asked alexa to give BroHug advice"))
+
+ONPREM_COST_SAVINGS_RESPONSE = alexa.create_response(
+    "The OneSphere service private cloud cost savings feature is not yet implemented",
+    end_session=False,
+    card_obj=alexa.create_card(title="GetOnpremCostSavingsIntent activated", subtitle=None,
+                               content="asked alexa to query the OneSphere metrics REST API and calculate" \
+                                       " the total private cloud monthly cost savings"))
+
+# --------------- Middleware applied around the route handlers ----------------------
+
+
+def install_middleware(voice_handler):
+    """ Register the middleware used around the OneSphere handlers. Shared
+    with the async handlers in lambda_function_async.py.
+    """
+    voice_handler.use(timing)
+    voice_handler.use(ErrorSpeech("Sorry, I could not reach the OneSphere service. Please try again later.",
+                                  messages=[(RateLimited, "The OneSphere service is busy right now. " +
+                                                          "Please try again in a moment.")]))
+    voice_handler.use(SamplingProfiler(rate=float(os.environ.get('profile_rate', 0))))
+
+    # Metrics are aggregated per month, a few minutes of staleness is fine
+    metrics_cache = ResponseCache(ttl=300)
+    for intent in ('TotalMonSpend', 'OnpremCurrentMonSpend', 'AWSNCSManagedUtil'):
+        voice_handler.use(metrics_cache, intent=intent)
+    # Handlers raise on failed calls, so only successful answers are cached
+    voice_handler.use(ErrorSpeech("The OneSphere service is currently unavailable"), intent='ServiceStatus')
+    voice_handler.use(ResponseCache(ttl=30), intent='ServiceStatus')
+
+
+install_middleware(alexa)
+
 # --------------- Decorated functions for the route handlers ----------------------
 
 
@@ -97,7 +324,7 @@ def create_ns_session(api_base, user_name, password, session_id):
 @alexa.default_handler()
 def default_handler(request):
     """ The default handler gets invoked if no handler is set for a request """
-    return alexa.create_response(message="Just ask")
+    return DEFAULT_RESPONSE
 
 
 # syntactic sugar
@@ -105,29 +332,19 @@ def default_handler(request):
 # Welcome message when no intent is given
 @alexa.request_handler("LaunchRequest")
 def launch_request_handler(request):
-    return alexa.create_response(message="Welcome to the OneSphere voice activated cloud management console. " +
-                                         "Please ask me something about your OneSphere service")
+    return LAUNCH_RESPONSE
 
 
 # Message when receiving an end session intent
 @alexa.request_handler("SessionEndedRequest")
 def session_ended_request_handler(request):
-    return alexa.create_response(
-        message="Thank you for trying the OneSphere voice activated cloud management console. " +
-                "Have a nice day! ")
+    return SESSION_ENDED_RESPONSE
 
 
 # Message when receiving a brohug intent
 @alexa.intent_handler("BroHugDistance")
 def get_brohug_intent_handler(request):
-
-    card = alexa.create_card(title="GetBroHugIntent activated", subtitle=None,
-                             content="asked alexa to give BroHug advice")
-
-    return alexa.create_response(
-        message="You must remember to maintain a safe groin distance of 1 foot " +
-                "when executing a proper bro hug.",
-        end_session=False, card_obj=card)
+    return BROHUG_RESPONSE
 
 
 @alexa.intent_handler('ServiceStatus')
@@ -140,17 +357,9 @@ def get_service_intent_handler(request):
     api_base = request.metadata.get('api_base', None)
 
     # Get service status
-    r = safe_requests(requests.get, api_base + "/status")
-
-    if 'service' in r:
-        speech_output = "The OneSphere service is currently " + r["service"]
-    else:
-        speech_output = "The OneSphere service is currently unavailable"
-
-    card = alexa.create_card(title="GetServiceStatusIntent activated", subtitle=None,
-                             content="asked alexa to query the OneSphere service status REST API")
+    r = budgeted_requests(requests.get, api_base, "/status")
 
-    return alexa.create_response(speech_output,end_session=False, card_obj=card)
+    return status_response(r)
 
 
 @alexa.intent_handler('TotalMonSpend')
@@ -160,29 +369,17 @@ def get_tot_mon_spend_handler(request):
 
     # Get KMS secured environment variables
     api_base = request.metadata.get('api_base', None)
-    token = request.metadata.get('token', None)
+    token = session_token(request)
 
     # Get service status
-    # periodStart should default to the current month
-    # 'periodStart': '2018-01-01T00:00:00Z',
-    payload = {'category': 'providers', 'name': 'cost.total',
-               'period': 'month', 'periodCount': '-1', 'view': 'full'}
-    r = safe_requests(requests.get, api_base + "/metrics", params=payload,
-                      headers={'accept': 'application/json',
-                               'Content-Type': 'application/json',
-                               'Authorization': token}
-                      )
+    r = budgeted_requests(requests.get, api_base, "/metrics", params=TOTAL_SPEND_QUERY,
+                          headers={'accept': 'application/json',
+                                   'Content-Type': 'application/json',
+                                   'Authorization': token}
+                          )
 
     # Parse metrics JSON output
-    metric_data = MetricData(r)
-    total_spend = metric_data.get_cost()
-    speech_output = "The OneSphere service spend for this month is ${:,.2f}".format(total_spend)
-
-    card = alexa.create_card(title="GetTotMonSpendIntent activated", subtitle=None,
-                             content="asked alexa to query the OneSphere metrics REST API and calculate"\
-                             " the total monthly spend")
-
-    return alexa.create_response(speech_output,end_session=False, card_obj=card)
+    return total_spend_response(r)
 
 
 @alexa.intent_handler('OnpremCurrentMonSpend')
@@ -192,30 +389,17 @@ def get_onprem_spend_handler(request):
 
     # Get KMS secured environment variables
     api_base = request.metadata.get('api_base', None)
-    token = request.metadata.get('token', None)
+    token = session_token(request)
 
     # Get service status
-    # periodStart should default to the current month
-    # 'periodStart': '2018-01-01T00:00:00Z',
-    payload = {'category': 'providers', 'query': 'providerTypeUri EQ /rest/provider-types/ncs',
-               'name': 'cost.usage', 'period': 'month', 'periodCount': '-1', 'view': 'full'
-               }
-    params = urllib.urlencode(payload)
-    r = safe_requests(requests.get, api_base + "/metrics", params=params,
-                      headers={'accept': 'application/json;charset=UTF-8',
-                               'Authorization': token}
-                      )
+    params = urllib.urlencode(onprem_spend_query(provider_type_uri(request)))
+    r = budgeted_requests(requests.get, api_base, "/metrics", params=params,
+                          headers={'accept': 'application/json;charset=UTF-8',
+                                   'Authorization': token}
+                          )
 
     # Parse metrics JSON output
-    metric_data = MetricData(r)
-    total_spend = metric_data.get_cost()
-    speech_output = "The OneSphere service private cloud spend for this month is ${:,.2f}".format(total_spend)
-
-    card = alexa.create_card(title="GetOnpremSpendIntent activated", subtitle=None,
-                             content="asked alexa to query the OneSphere metrics REST API and calculate" \
-                                     " the total private cloud monthly spend")
-
-    return alexa.create_response(speech_output,end_session=False, card_obj=card)
+    return onprem_spend_response(r)
 
 
 @alexa.intent_handler('OnPremCostSavings')
@@ -223,14 +407,7 @@ def get_onprem_cost_savings_handler(request):
     """ Queries the OneSphere metrics API and returns the total private cloud cost savings.
         NOT YET IMPLEMENTED
     """
-
-    speech_output = "The OneSphere service private cloud cost savings feature is not yet implemented"
-
-    card = alexa.create_card(title="GetOnpremCostSavingsIntent activated", subtitle=None,
-                             content="asked alexa to query the OneSphere metrics REST API and calculate" \
-                                     " the total private cloud monthly cost savings")
-
-    return alexa.create_response(speech_output,end_session=False, card_obj=card)
+    return ONPREM_COST_SAVINGS_RESPONSE
 
 
 @alexa.intent_handler('AWSNCSManagedUtil')
@@ -240,29 +417,16 @@ def get_onprem_cost_efficiency_handler(request):
 
     # Get KMS secured environment variables
     api_base = request.metadata.get('api_base', None)
-    token = request.metadata.get('token', None)
+    token = session_token(request)
 
     # Get service status
-    # periodStart should default to the current month
-    # 'periodStart': '2018-01-01T00:00:00Z',
-    payload = {'category': 'providers', 'groupBy': 'providerTypeUri',
-               'name': 'cost.efficiency', 'period': 'month', 'periodCount': '-1', 'view': 'full'
-               }
-    r = safe_requests(requests.get, api_base + "/metrics", params=payload,
-                      headers={'accept': 'application/json',
-                               'Authorization': token}
-                      )
+    r = budgeted_requests(requests.get, api_base, "/metrics", params=ONPREM_EFFICIENCY_QUERY,
+                          headers={'accept': 'application/json',
+                                   'Authorization': token}
+                          )
 
     # Parse metrics JSON output
-    metric_data = MetricData(r)
-    total_spend = metric_data.get_cost()
-    speech_output = "The OneSphere service private cloud efficiency for this month is ${:,.2f}".format(total_spend)
-
-    card = alexa.create_card(title="GetOnpremCostEfficiencyIntent activated", subtitle=None,
-                             content="asked alexa to query the OneSphere metrics REST API and calculate" \
-                                     " the total private cloud monthly cost efficiency")
-
-    return alexa.create_response(speech_output,end_session=False, card_obj=card)
+    return onprem_efficiency_response(r)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+"""
+Async counterpart of lambda_function.py for hosting the skill in a long
+running Python 3.7+ process (requires aiohttp). Handlers await the pooled
+AsyncOneSphereClient, so one event loop serves many concurrent requests
+while they wait on OneSphere. Queries, speech, responses, middleware and
+the outbound budget are shared with lambda_function.py.
+
+    response = await lambda_handler_async(request_obj)
+    ...
+    await close_clients()  # on shutdown
+"""
+
+import logging
+import os
+from ask.alexa_io import VoiceHandler
+from ncs.osph_async_io import AsyncOneSphereClient
+from ncs.osph_errors import OneSphereError, RateLimited
+from ncs.osph_metadata_index import MetadataIndex
+from lambda_function import (RATE_LIMITER, RATE_LIMIT_MAX_WAIT, ANSWER_CACHE, install_middleware,
+                             session_token, TOTAL_SPEND_QUERY, ONPREM_EFFICIENCY_QUERY, onprem_spend_query,
+                             NCS_PROVIDER_TYPE_URI, status_response, total_spend_response,
+                             onprem_spend_response, onprem_efficiency_response, DEFAULT_RESPONSE, LAUNCH_RESPONSE,
+                             SESSION_ENDED_RESPONSE, BROHUG_RESPONSE, ONPREM_COST_SAVINGS_RESPONSE)
+
+alexa = VoiceHandler()
+install_middleware(alexa)
+
+# One pooled client and one metadata index per tenant (api_base)
+_clients = {}
+_metadata_indexes = {}
+
+
+async def lambda_handler_async(request_obj, context=None):
+    '''
+    Coroutine entry point, configured from the same environment variables
+    as lambda_handler.
+    '''
+
+    # Setup configuration vars from environment
+    api_base = os.environ['api_base']
+    user_name = os.environ['user']
+    password = os.environ['password']
+    skill_id = os.environ['skill_id']
+
+    # Get the cached session ID (None when shed, handlers needing it report the service as busy)
+    try:
+        session_token = await get_client(api_base).session_token(user_name, password)
+    except RateLimited:
+        session_token = None
+    logging.debug("session_token: api_base = %s", api_base)
+
+    metadata = {'user_name': user_name,
+                'password': password,
+                'api_base': api_base,
+                'token': session_token,
+                'skill_id': skill_id}
+
+    return await alexa.route_request_async(request_obj, metadata)
+
+
+def get_client(api_base):
+    """ The shared client of a tenant, created on first use """
+    client = _clients.get(api_base)
+    if client is None:
+        client = _clients[api_base] = AsyncOneSphereClient(
+            api_base, rate_limiter=RATE_LIMITER, answer_cache=ANSWER_CACHE, max_wait=RATE_LIMIT_MAX_WAIT)
+    return client
+
+
+async def close_clients():
+    """ Close the pooled connections of every tenant, e.g. on shutdown """
+    while _clients:
+        await _clients.popitem()[1].close()
+
+
+async def resolve_uri_async(request, collection, spoken_name):
+    """ Coroutine version of lambda_function.resolve_uri """
+    api_base = request.metadata.get('api_base', None)
+    token = session_token(request)
+    index = _metadata_indexes.setdefault(api_base, MetadataIndex())
+
+    if index.is_stale(collection):
+        headers, full = index.request_headers(collection, {'accept': 'application/json',
+                                                           'Authorization': token})
+        try:
+            status, body, response_headers = await get_client(api_base).fetch(
+                'GET', "/" + collection, params={'view': 'full'}, headers=headers)
+            index.update(collection, full, status, body, response_headers)
+        except OneSphereError as e:
+            index.refresh_failed(collection, e)
+
+    return index.collections[collection].lookup(spoken_name)
+
+
+async def provider_type_uri_async(request):
+    """ Coroutine version of lambda_function.provider_type_uri """
+    spoken_name = request.get_slot_value('ProviderType')
+    if spoken_name:
+        try:
+            uri = await resolve_uri_async(request, 'provider-types', spoken_name)
+            if uri is not None:
+                return uri
+        except OneSphereError as e:
+            logging.warning("Could not resolve provider type %s: %s", spoken_name, e)
+    return NCS_PROVIDER_TYPE_URI
+
+
+# --------------- Coroutine route handlers ----------------------
+
+
+@alexa.default_handler()
+async def default_handler(request):
+    return DEFAULT_RESPONSE
+
+
+@alexa.request_handler("LaunchRequest")
+async def launch_request_handler(request):
+    return LAUNCH_RESPONSE
+
+
+@alexa.request_handler("SessionEndedRequest")
+async def session_ended_request_handler(request):
+    return SESSION_ENDED_RESPONSE
+
+
+@alexa.intent_handler("BroHugDistance")
+async def get_brohug_intent_handler(request):
+    return BROHUG_RESPONSE
+
+
+@alexa.intent_handler('ServiceStatus')
+async def get_service_intent_handler(request):
+    """ Query the OneSphere status API and return the service status.
+    """
+    client = get_client(request.metadata.get('api_base', None))
+    return status_response(await client.get_status())
+
+
+@alexa.intent_handler('TotalMonSpend')
+async def get_tot_mon_spend_handler(request):
+    """ Queries the OneSphere metrics API and returns the total current month spend.
+    """
+    client = get_client(request.metadata.get('api_base', None))
+    r = await client.get_metrics(session_token(request), TOTAL_SPEND_QUERY)
+    return total_spend_response(r)
+
+
+@alexa.intent_handler('OnpremCurrentMonSpend')
+async def get_onprem_spend_handler(request):
+    """ Queries the OneSphere metrics API and returns the total private cloud month spend.
+    """
+    client = get_client(request.metadata.get('api_base', None))
+    query = onprem_spend_query(await provider_type_uri_async(request))
+    r = await client.get_metrics(session_token(request), query)
+    return onprem_spend_response(r)
+
+
+@alexa.intent_handler('OnPremCostSavings')
+async def get_onprem_cost_savings_handler(request):
+    """ NOT YET IMPLEMENTED """
+    return ONPREM_COST_SAVINGS_RESPONSE
+
+
+@alexa.intent_handler('AWSNCSManagedUtil')
+async def get_onprem_cost_efficiency_handler(request):
+    """ Queries the OneSphere metrics API and returns the private cloud cost efficiency.
+    """
+    client = get_client(request.metadata.get('api_base', None))
+    r = await client.get_metrics(session_token(request), ONPREM_EFFICIENCY_QUERY)
+    return onprem_efficiency_response(r)
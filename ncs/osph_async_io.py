@@ -0,0 +1,166 @@
+"""
+asyncio based OneSphere REST client for host mode (Python 3.7+, aiohttp).
+A single client keeps one pooled connector so concurrent skill requests
+share keep-alive connections instead of blocking a thread each.
+"""
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+
+from .osph_errors import RateLimited
+
+JSON_HEADERS = {'accept': 'application/json', 'Content-Type': 'application/json'}
+
+
+class AsyncOneSphereClient(object):
+    """
+    Pooled async client around the OneSphere REST API of one tenant.
+    Mirrors safe_requests / budgeted_requests / create_ns_session from
+    lambda_function.py: failures are logged and surface as an empty dict,
+    calls go through the optional RateLimiter (waiting on the event loop)
+    and, when over budget, the last good answer in the AnswerCache is
+    served or RateLimited raised. Session tokens are reused for token_ttl
+    seconds, or until a call using one is answered 401.
+    """
+    def __init__(self, api_base, pool_size=100, timeout=10.0,
+                 rate_limiter=None, answer_cache=None, max_wait=1.0, token_ttl=600):
+        self.api_base = api_base
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.answer_cache = answer_cache
+        self.max_wait = max_wait
+        self.token_ttl = token_ttl
+        self._session = None
+        self._tokens = {}
+        self._token_requests = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _acquire(self, path, max_wait):
+        """ Take a token for path, queueing on the event loop for at most max_wait """
+        if self.rate_limiter is None:
+            return True
+        deadline = time.time() + max_wait
+        while True:
+            granted, wait = self.rate_limiter.try_acquire(self.api_base, path)
+            if granted:
+                return True
+            if time.time() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+    async def _request(self, method, path, **kwargs):
+        """ (status, json body, headers), status None when the call failed
+        before any response and body {} unless status is 200
+        """
+        try:
+            async with self._get_session().request(method, self.api_base + path, **kwargs) as r:
+                if r.status == 401:
+                    self.forget_token((kwargs.get('headers') or {}).get('Authorization'))
+                if r.status != 200:
+                    return r.status, {}, r.headers
+                return r.status, await r.json(content_type=None), r.headers
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logging.error("Error: {}".format(e))
+            return None, {}, {}
+
+    async def fetch(self, method, path, **kwargs):
+        """ Budgeted request returning (status, json body, headers), status
+        None on failure. Raises RateLimited when shed.
+        """
+        if not await self._acquire(path, self.max_wait):
+            logging.warning("Rate limit: shedding call to %s%s", self.api_base, path)
+            raise RateLimited(self.api_base + path)
+        return await self._request(method, path, **kwargs)
+
+    async def safe_request(self, method, path, **kwargs):
+        """ Budgeted request returning the decoded JSON body, {} on any error
+        """
+        key = (self.api_base, repr(kwargs.get('params')), repr(kwargs.get('data')))
+        cached = self.answer_cache.get(path, key) if self.answer_cache is not None else None
+
+        if not await self._acquire(path, 0.0 if cached is not None else self.max_wait):
+            # A concurrent call may have stored an answer while this one queued
+            if cached is None and self.answer_cache is not None:
+                cached = self.answer_cache.get(path, key)
+            if cached is not None:
+                logging.info("Rate limit: served cached answer for %s%s", self.api_base, path)
+                return cached
+            logging.warning("Rate limit: shedding call to %s%s", self.api_base, path)
+            raise RateLimited(self.api_base + path)
+
+        status, body, headers = await self._request(method, path, **kwargs)
+        if status is not None and status != 200:
+            logging.error("Error: Unexpected response {}".format(status))
+        if body and self.answer_cache is not None:
+            self.answer_cache.put(path, key, body)
+        return body
+
+    async def create_session(self, user_name, password):
+        """ Create a OneSphere session and return the token ("" on failure)
+        """
+        payload = {'userName': user_name, 'password': password}
+        r = await self.safe_request('POST', "/session", data=json.dumps(payload),
+                                    headers=JSON_HEADERS)
+        if 'token' in r:
+            return r['token']
+        else:
+            return ""
+
+    async def session_token(self, user_name, password):
+        """ Cached session token for the credentials ("" on failure).
+        Concurrent callers share a single /session request.
+        """
+        credentials = (user_name, password)
+        token, expires = self._tokens.get(credentials, (None, 0))
+        if token and time.time() < expires:
+            return token
+        request = self._token_requests.get(credentials)
+        if request is None:
+            request = self._token_requests[credentials] = asyncio.ensure_future(
+                self._new_token(credentials))
+        # shielded so one cancelled caller does not cancel it for the others
+        return await asyncio.shield(request)
+
+    async def _new_token(self, credentials):
+        try:
+            token = await self.create_session(*credentials)
+        finally:
+            self._token_requests.pop(credentials, None)
+        if token:
+            self._tokens[credentials] = (token, time.time() + self.token_ttl)
+        return token
+
+    def forget_token(self, token):
+        """ Drop a token the server rejected, the next caller gets a new one """
+        for credentials, (cached, expires) in list(self._tokens.items()):
+            if cached == token:
+                del self._tokens[credentials]
+
+    async def get_status(self):
+        return await self.safe_request('GET', "/status")
+
+    async def get_metrics(self, token, params):
+        headers = dict(JSON_HEADERS, Authorization=token)
+        return await self.safe_request('GET', "/metrics", params=params, headers=headers)
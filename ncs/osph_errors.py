@@ -0,0 +1,12 @@
+"""
+Exceptions raised while talking to the OneSphere REST API. Handlers let
+them propagate so the ErrorSpeech middleware can answer with speech.
+"""
+
+
+class OneSphereError(Exception):
+    """ OneSphere did not return a usable answer """
+
+
+class RateLimited(OneSphereError):
+    """ The call was shed because the outbound budget is exhausted """
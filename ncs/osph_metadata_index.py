@@ -0,0 +1,187 @@
+"""
+Locally cached index of OneSphere providers, provider types, projects and
+zones, used to resolve spoken slot values to resource URIs without listing
+the collections on every request.
+
+All lookup structures are plain dicts built at refresh time, so a lookup is
+a couple of dict probes and only falls back to difflib on a miss, over the
+few names sharing the most trigrams with the spoken one.
+"""
+import difflib
+import logging
+import re
+import time
+
+from .osph_errors import OneSphereError
+
+COLLECTIONS = ('providers', 'provider-types', 'projects', 'zones')
+
+_SOUNDEX_CODES = dict((c, str(d)) for d, letters in enumerate(
+    ('aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r')) for c in letters)
+
+
+def normalize(name):
+    """ Lower case and drop everything but letters and digits """
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+def soundex(word):
+    """ American Soundex of a single word ('' if it has no letters) """
+    letters = [c for c in word.lower() if c.isalpha()]
+    if not letters:
+        return ''
+    code, last = letters[0].upper(), _SOUNDEX_CODES.get(letters[0])
+    for c in letters[1:]:
+        digit = _SOUNDEX_CODES.get(c)
+        if digit != last and digit != '0':
+            code += digit
+        if c not in 'hw':
+            last = digit
+    return (code + '000')[:4]
+
+
+def trigrams(key):
+    """ Trigrams of a normalized name, padded so short names have some """
+    padded = ' ' + key + ' '
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def phonetic_key(name):
+    """ Soundex of every word, digits kept verbatim """
+    return ' '.join(soundex(w) if w.isalpha() else w
+                    for w in re.findall(r'[a-z]+|[0-9]+', name.lower()))
+
+
+class CollectionIndex(object):
+    """
+    Name -> URI index for one collection. Members are keyed by uri so an
+    incremental refresh just merges the changed members in.
+    """
+    def __init__(self):
+        self.members = {}
+        self._exact = {}
+        self._phonetic = {}
+        self._trigrams = {}
+
+    def merge(self, members, replace=False):
+        if replace:
+            self.members = {}
+        for member in members:
+            if 'uri' in member:
+                self.members[member['uri']] = member
+        self._build()
+
+    def _build(self):
+        exact, phonetic = {}, {}
+        for uri, member in self.members.items():
+            # provider types are often spoken by their id (/rest/provider-types/ncs)
+            for name in (member.get('name') or '', uri.rstrip('/').rsplit('/', 1)[-1]):
+                if normalize(name):
+                    exact.setdefault(normalize(name), uri)
+                    phonetic.setdefault(phonetic_key(name), uri)
+        by_trigram = {}
+        for key in exact:
+            for trigram in trigrams(key):
+                by_trigram.setdefault(trigram, []).append(key)
+        self._exact, self._phonetic, self._trigrams = exact, phonetic, by_trigram
+
+    def candidates(self, key, limit=10):
+        """ The indexed names sharing the most trigrams with key """
+        shared = {}
+        for trigram in trigrams(key):
+            for name in self._trigrams.get(trigram, ()):
+                shared[name] = shared.get(name, 0) + 1
+        return sorted(shared, key=shared.get, reverse=True)[:limit]
+
+    def lookup(self, spoken, cutoff=0.8):
+        """ Return the URI best matching a spoken name, or None """
+        if not spoken:
+            return None
+        key = normalize(spoken)
+        if key in self._exact:
+            return self._exact[key]
+        phonetic = phonetic_key(spoken)
+        if phonetic in self._phonetic:
+            return self._phonetic[phonetic]
+        close = difflib.get_close_matches(key, self.candidates(key), n=1, cutoff=cutoff)
+        return self._exact[close[0]] if close else None
+
+
+class MetadataIndex(object):
+    """
+    Periodically refreshed index over the OneSphere metadata collections.
+
+    fetch(path, params, headers) must GET path on the api_base and return
+    (status, body, response_headers); status is None when the call failed
+    before any response. Refreshes are conditional on the validator the
+    server sent last (ETag, else Last-Modified / Date), so an unchanged
+    collection costs a 304 and keeps its entries. A full reload happens
+    every full_refresh seconds to drop deleted resources. A failed refresh
+    is retried after retry seconds.
+    """
+    def __init__(self, ttl=600, full_refresh=3600, retry=30):
+        self.ttl = ttl
+        self.full_refresh = full_refresh
+        self.retry = retry
+        self.collections = dict((name, CollectionIndex()) for name in COLLECTIONS)
+        self._validators = {}
+        self._next_refresh = {}
+        self._reloaded = {}
+
+    def is_stale(self, collection, now=None):
+        return (now or time.time()) >= self._next_refresh.get(collection, 0)
+
+    def request_headers(self, collection, headers=None):
+        """ Headers for the next refresh and whether it is a full reload """
+        headers = dict(headers or {})
+        validator = self._validators.get(collection)
+        full = validator is None or time.time() - self._reloaded.get(collection, 0) > self.full_refresh
+        if not full:
+            name, value = validator
+            headers['If-None-Match' if name == 'ETag' else 'If-Modified-Since'] = value
+        return headers, full
+
+    def update(self, collection, full, status, body, headers):
+        """ Apply the answer to a refresh. Raises OneSphereError on failure. """
+        now = time.time()
+        if status == 304 and not full:
+            self._next_refresh[collection] = now + self.ttl
+            return
+        if status != 200 or 'members' not in body:
+            raise OneSphereError("could not refresh {} (status {})".format(collection, status))
+
+        self.collections[collection].merge(body['members'], replace=full)
+        headers = headers or {}
+        for name in ('ETag', 'Last-Modified', 'Date'):
+            if headers.get(name):
+                self._validators[collection] = (name, headers[name])
+                break
+        if full:
+            self._reloaded[collection] = now
+        self._next_refresh[collection] = now + self.ttl
+
+    def refresh_failed(self, collection, error):
+        """ Schedule a retry after a failed refresh. The error is re-raised
+        when there are no entries to fall back on.
+        """
+        self._next_refresh[collection] = time.time() + self.retry
+        if not self.collections[collection].members:
+            raise error
+        logging.warning("Metadata index: using stale %s, %s", collection, error)
+
+    def refresh(self, fetch, collection, headers=None):
+        headers, full = self.request_headers(collection, headers)
+        status, body, response_headers = fetch("/" + collection, {'view': 'full'}, headers)
+        self.update(collection, full, status, body, response_headers)
+
+    def lookup(self, collection, spoken, fetch=None, headers=None):
+        """ Resolve a spoken name in a collection to its URI. When fetch is
+        given a stale collection is refreshed first; if that fails the
+        current entries are used, unless there are none.
+        """
+        if fetch is not None and self.is_stale(collection):
+            try:
+                self.refresh(fetch, collection, headers)
+            except OneSphereError as e:
+                self.refresh_failed(collection, e)
+        return self.collections[collection].lookup(spoken)
@@ -0,0 +1,141 @@
+"""
+Token bucket rate limiting for outbound OneSphere traffic.
+Buckets are kept per (tenant, endpoint); a tenant is the api_base a call
+goes to and an endpoint is the REST path ('/session', '/metrics', ...).
+
+The default backend keeps bucket state in process memory. FileLockBackend
+keeps it in small JSON files guarded by flock() so several worker
+processes on one host share a single budget.
+
+AnswerCache keeps the last good answer per call so callers can serve it
+instead of shedding when they are over budget.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket: refills at `rate` tokens per second up to `capacity`.
+    State is a plain (tokens, stamp) tuple so backends can persist it.
+    """
+    def __init__(self, rate, capacity):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("Token bucket needs rate > 0 and capacity >= 1, got "
+                             "rate={} capacity={}".format(rate, capacity))
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+
+    def initial_state(self, now):
+        return (self.capacity, now)
+
+    def take(self, state, now, tokens=1):
+        """ Returns (granted, wait, new_state). wait is the number of seconds
+        until `tokens` would be available when not granted.
+        """
+        level, stamp = state
+        level = min(self.capacity, level + (now - stamp) * self.rate)
+        if level >= tokens:
+            return True, 0.0, (level - tokens, now)
+        return False, (tokens - level) / self.rate, (level, now)
+
+
+class MemoryBackend(object):
+    """ In-process bucket state, safe across threads """
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, bucket, tokens=1):
+        with self._lock:
+            now = time.time()
+            state = self._states.get(key) or bucket.initial_state(now)
+            granted, wait, self._states[key] = bucket.take(state, now, tokens)
+            return granted, wait
+
+
+class FileLockBackend(object):
+    """ Bucket state shared between processes through flock()ed files """
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        name = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.bucket')
+
+    def take(self, key, bucket, tokens=1):
+        import fcntl
+
+        with open(self._path(key), 'a+') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                fp.seek(0)
+                try:
+                    state = tuple(json.loads(fp.read()))
+                except ValueError:
+                    state = bucket.initial_state(now)
+                granted, wait, state = bucket.take(state, now, tokens)
+                fp.seek(0)
+                fp.truncate()
+                fp.write(json.dumps(state))
+                return granted, wait
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+class RateLimiter(object):
+    """
+    Per tenant / per endpoint budget. `limits` maps an endpoint to a
+    (rate, capacity) tuple; endpoints not listed use `default`.
+    """
+    def __init__(self, default=(5, 10), limits=None, backend=None):
+        self.default = TokenBucket(*default)
+        self.limits = dict((endpoint, TokenBucket(*limit))
+                           for endpoint, limit in (limits or {}).items())
+        self.backend = backend or MemoryBackend()
+
+    def try_acquire(self, tenant, endpoint):
+        """ Take one token without waiting. Returns (granted, wait) where wait
+        is the number of seconds until a token is available.
+        """
+        return self.backend.take((tenant, endpoint), self.limits.get(endpoint, self.default))
+
+    def acquire(self, tenant, endpoint, max_wait=0.0):
+        """ Take one token, queueing for at most max_wait seconds.
+        Returns False when the call should be shed.
+        """
+        deadline = time.time() + max_wait
+        while True:
+            granted, wait = self.try_acquire(tenant, endpoint)
+            if granted:
+                return True
+            if time.time() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class AnswerCache(object):
+    """
+    Last good answer per call. Answers expire after the ttl of their
+    endpoint (`ttls`) or `default_ttl`, so e.g. session tokens are not
+    handed out after they may have expired on the server.
+    """
+    def __init__(self, default_ttl=3600, ttls=None):
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self._answers = {}
+
+    def get(self, endpoint, key):
+        entry = self._answers.get((endpoint, key))
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def put(self, endpoint, key, answer):
+        self._answers[(endpoint, key)] = (time.time() + self.ttls.get(endpoint, self.default_ttl), answer)